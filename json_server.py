@@ -2,10 +2,10 @@ from flask import Flask, request
 import random
 import json
 import datetime
-import pytz
+from zoneinfo import ZoneInfo
 
 app = Flask(__name__)
-tz = pytz.timezone('Europe/Warsaw')
+tz = ZoneInfo('Europe/Warsaw')
 
 with open('samples/CommonInverterData.json', 'r') as f:
     common_inverter_data = [json.loads(r) for r in f.readlines()]
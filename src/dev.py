@@ -4,7 +4,7 @@ from astral import LocationInfo
 from astral.location import Location
 
 import logging
-import pytz
+from zoneinfo import ZoneInfo
 
 # configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(name)s] %(levelname)s: %(message)s')
@@ -12,7 +12,7 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(name)s] %(levelna
 client = InfluxDBClient(url='http://localhost:8087', username='grafana', password='grafana', org='fronius')
 bucket = 'grafana'
 location = Location(LocationInfo('Poznan', 'Europe', 'Europe/Warsaw', 52.408078, 16.933618))
-tz = pytz.timezone('Europe/Warsaw')
+tz = ZoneInfo('Europe/Warsaw')
 endpoints = [
     'http://172.30.1.11:5000/3PInverterData.json',
     'http://172.30.1.11:5000/CommonInverterData.json',
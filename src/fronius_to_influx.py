@@ -1,15 +1,60 @@
+import asyncio
+import hashlib
 import logging
 import datetime
-import json
-from time import sleep
-from typing import Any, Dict, List, Type
+import time
+from typing import Any, Dict, List, Optional, Tuple, Type
 
-import pytz
+try:
+    import orjson
+except ImportError:
+    import json as orjson  # json.loads also accepts bytes
+
+import aiohttp
 from astral.location import Location
 from influxdb_client import InfluxDBClient
-from influxdb_client.client.write_api import SYNCHRONOUS
-from requests import get
-from requests.exceptions import ConnectionError
+from influxdb_client.client.write_api import WriteOptions, WriteType
+
+
+_COMMON_FIELDS = ('FAC', 'IAC', 'IDC', 'PAC', 'UAC', 'UDC', 'DAY_ENERGY', 'YEAR_ENERGY', 'TOTAL_ENERGY')
+_3P_FIELDS = ('IAC_L1', 'IAC_L2', 'IAC_L3', 'UAC_L1', 'UAC_L2', 'UAC_L3')
+_MINMAX_FIELDS = ('DAY_PMAX', 'DAY_UACMAX', 'DAY_UDCMAX',
+                  'YEAR_PMAX', 'YEAR_UACMAX', 'YEAR_UDCMAX',
+                  'TOTAL_PMAX', 'TOTAL_UACMAX', 'TOTAL_UDCMAX')
+
+# additional fields for GEN24 Symo, keyed by the marker field in the response
+_OPTIONAL = {
+    'SAC': ('SAC',),
+    'IDC_2': ('IDC_2', 'UDC_2'),
+    'IDC_3': ('IDC_3', 'UDC_3'),
+    'IDC_4': ('IDC_4', 'UDC_4'),
+}
+_OPTIONAL_KEYS = frozenset(_OPTIONAL)
+
+
+_EMPTY: Dict[Any, Any] = {}
+
+
+def _fz(body: Dict, key: str) -> float:
+    value = body.get(key, _EMPTY).get('Value', 0)
+    return float(value) if value else 0.0
+
+
+def _to_ns(timestamp: str) -> int:
+    dt = datetime.datetime.fromisoformat(timestamp)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return int(dt.timestamp() * 1_000_000_000)
+
+
+def _lp_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return f'{value}i'
+    if isinstance(value, str):
+        return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return str(float(value))
 
 
 class WrongFroniusData(Exception):
@@ -36,139 +81,123 @@ class FroniusToInflux:
         self.tz = tz
 
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.data: Dict[Any, Any] = {}
+        self._sun_cache: Optional[Tuple[datetime.date, Dict]] = None
+        self._last_hash: Dict[str, bytes] = {}
+        self._write_api = client.write_api(write_options=WriteOptions(
+            write_type=WriteType.batching, batch_size=100, flush_interval=10_000, jitter_interval=1_000))
+
+    def translate_response(self, data: Dict) -> List[str]:
+        collection = data['Head']['RequestArguments']['DataCollection']
+        timestamp = data['Head']['Timestamp']
+        timestamp = timestamp.replace("+00:00", "")  # workaround for wrong timezone
 
-    def get_float_or_zero(self, value: str) -> float:
-        internal_data: Dict[Any, Any] = {}
         try:
-            internal_data = self.data['Body']['Data']
+            body = data['Body']['Data']
         except KeyError:
             raise WrongFroniusData('Response structure is not healthy.')
-        result = internal_data.get(value, {}).get('Value', 0)
-        if result:
-            return float(result)
-        return 0.0
-
-    def translate_response(self) -> List[Dict]:
-        collection = self.data['Head']['RequestArguments']['DataCollection']
-        timestamp = self.data['Head']['Timestamp']
-        timestamp = timestamp.replace("+00:00", "")  # workaround for wrong timezone
 
-        self.logger.debug(f"translate {collection}, {timestamp}: {self.data['Body']['Data']}")
-        if collection == 'CommonInverterData':
-            data = self.data['Body']['Data']
-
-            device_status = {
-                    'measurement': 'DeviceStatus',
-                    'time': timestamp,
-                    'fields': data['DeviceStatus']
-                }
-
-            inverter_data = {
-                    'measurement': collection,
-                    'time': timestamp,
-                    'fields': {
-                        'FAC': self.get_float_or_zero('FAC'),
-                        'IAC': self.get_float_or_zero('IAC'),
-                        'IDC': self.get_float_or_zero('IDC'),
-                        'PAC': self.get_float_or_zero('PAC'),
-                        'UAC': self.get_float_or_zero('UAC'),
-                        'UDC': self.get_float_or_zero('UDC'),
-                        'DAY_ENERGY': self.get_float_or_zero('DAY_ENERGY'),
-                        'YEAR_ENERGY': self.get_float_or_zero('YEAR_ENERGY'),
-                        'TOTAL_ENERGY': self.get_float_or_zero('TOTAL_ENERGY'),
-                    }
-                }
-
-            # add additional fields for GEN24 Symo
-            fields_strings = []
-            if 'SAC' in data:
-                fields_strings.append('SAC')
-            if 'IDC_2' in data:
-                fields_strings.extend(['IDC_2', 'UDC_2'])
-            if 'IDC_3' in data:
-                fields_strings.extend(['IDC_3', 'UDC_3'])
-            if 'IDC_4' in data:
-                fields_strings.extend(['IDC_4', 'UDC_4'])
-
-            for field in fields_strings:
-                inverter_data['fields'][field] = self.get_float_or_zero(field)
-
-            return [device_status, inverter_data]
-        elif collection == '3PInverterData':
-            return [
-                {
-                    'measurement': collection,
-                    'time': timestamp,
-                    'fields': {
-                        'IAC_L1': self.get_float_or_zero('IAC_L1'),
-                        'IAC_L2': self.get_float_or_zero('IAC_L2'),
-                        'IAC_L3': self.get_float_or_zero('IAC_L3'),
-                        'UAC_L1': self.get_float_or_zero('UAC_L1'),
-                        'UAC_L2': self.get_float_or_zero('UAC_L2'),
-                        'UAC_L3': self.get_float_or_zero('UAC_L3'),
-                    }
-                }
-            ]
-        elif collection == 'MinMaxInverterData':
-            return [
-                {
-                    'measurement': collection,
-                    'time': timestamp,
-                    'fields': {
-                        'DAY_PMAX': self.get_float_or_zero('DAY_PMAX'),
-                        'DAY_UACMAX': self.get_float_or_zero('DAY_UACMAX'),
-                        'DAY_UDCMAX': self.get_float_or_zero('DAY_UDCMAX'),
-                        'YEAR_PMAX': self.get_float_or_zero('YEAR_PMAX'),
-                        'YEAR_UACMAX': self.get_float_or_zero('YEAR_UACMAX'),
-                        'YEAR_UDCMAX': self.get_float_or_zero('YEAR_UDCMAX'),
-                        'TOTAL_PMAX': self.get_float_or_zero('TOTAL_PMAX'),
-                        'TOTAL_UACMAX': self.get_float_or_zero('TOTAL_UACMAX'),
-                        'TOTAL_UDCMAX': self.get_float_or_zero('TOTAL_UDCMAX'),
-                    }
-                }
-            ]
-        else:
+        self.logger.debug(f"translate {collection}, {timestamp}: {body}")
+        try:
+            builder = self._DISPATCH[collection]
+        except KeyError:
             raise DataCollectionError("Unknown data collection type.")
+        return builder(self, body, _to_ns(timestamp))
+
+    def _build_common_inverter_data(self, body: Dict, ts_ns: int) -> List[str]:
+        status_fields = ','.join(f'{key}={_lp_value(value)}' for key, value in body['DeviceStatus'].items())
+        device_status = f'DeviceStatus {status_fields} {ts_ns}'
+
+        field_parts = [f'{field}={_fz(body, field)}' for field in _COMMON_FIELDS]
+
+        append = field_parts.append
+        for key in body.keys() & _OPTIONAL_KEYS:
+            for field in _OPTIONAL[key]:
+                append(f'{field}={_fz(body, field)}')
+
+        inverter_data = f"CommonInverterData {','.join(field_parts)} {ts_ns}"
+        return [device_status, inverter_data]
+
+    def _build_3p_inverter_data(self, body: Dict, ts_ns: int) -> List[str]:
+        fields = ','.join(f'{field}={_fz(body, field)}' for field in _3P_FIELDS)
+        return [f'3PInverterData {fields} {ts_ns}']
+
+    def _build_min_max_inverter_data(self, body: Dict, ts_ns: int) -> List[str]:
+        fields = ','.join(f'{field}={_fz(body, field)}' for field in _MINMAX_FIELDS)
+        return [f'MinMaxInverterData {fields} {ts_ns}']
+
+    _DISPATCH = {
+        'CommonInverterData': _build_common_inverter_data,
+        '3PInverterData': _build_3p_inverter_data,
+        'MinMaxInverterData': _build_min_max_inverter_data,
+    }
 
 
     def sun_is_shining(self) -> None:
-        sun = self.location.sun()
-        if not self.IGNORE_SUN_DOWN and not sun['sunrise'] < datetime.datetime.now(tz=self.tz) < sun['sunset']:
+        if self.IGNORE_SUN_DOWN:
+            return None
+        today = datetime.date.today()
+        if self._sun_cache is None or self._sun_cache[0] != today:
+            self._sun_cache = (today, self.location.sun())
+        sun = self._sun_cache[1]
+        if not sun['sunrise'] < datetime.datetime.now(tz=self.tz) < sun['sunset']:
             raise SunIsDown
         return None
 
     def write_data_points(self, collected_data):
-        write_api = self.client.write_api(write_options=SYNCHRONOUS)
-        write_api.write(bucket=self.bucket, record=collected_data)
-        self.logger.info(f"written data: {[d['measurement'] for d in collected_data]}")
+        self._write_api.write(bucket=self.bucket, record=collected_data)
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info("written data: %s", [record.split(' ', 1)[0] for record in collected_data])
 
-    def run(self) -> None:
+    async def fetch_endpoint(self, session: aiohttp.ClientSession, url: str) -> bytes:
+        async with session.get(url) as response:
+            return await response.read()
+
+    async def run_async(self) -> None:
         self.logger.info("starting application")
-        try:
+        timeout = aiohttp.ClientTimeout(total=5)
+        headers = {'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'}
+        async with aiohttp.ClientSession(timeout=timeout, headers=headers) as session:
+            next_tick = time.monotonic()
             while True:
                 try:
                     self.sun_is_shining()
                     collected_data = []
-                    for url in self.endpoints:
-                        response = get(url)
-                        self.data = response.json()
-                        collected_data.extend(self.translate_response())
-                        sleep(self.BACKOFF_INTERVAL)
-                    self.write_data_points(collected_data)
-                    sleep(self.BACKOFF_INTERVAL)
+                    extend = collected_data.extend
+                    bodies = await asyncio.gather(*(self.fetch_endpoint(session, url) for url in self.endpoints))
+                    for url, body in zip(self.endpoints, bodies):
+                        digest = hashlib.blake2b(body, digest_size=8).digest()
+                        if self._last_hash.get(url) == digest:
+                            continue
+                        self._last_hash[url] = digest
+                        data = orjson.loads(body)
+                        extend(self.translate_response(data))
+                    if collected_data:
+                        self.write_data_points(collected_data)
+                    next_tick += self.BACKOFF_INTERVAL
+                    delay = next_tick - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    else:
+                        next_tick = time.monotonic()
                 except SunIsDown:
                     self.logger.info("Waiting for sunrise")
-                    sleep(60)
+                    await asyncio.sleep(60)
                     self.logger.info('Waited 60 seconds for sunrise')
-                except ConnectionError:
+                    next_tick = time.monotonic()
+                except aiohttp.ClientConnectionError:
                     self.logger.info("Waiting for connection...")
-                    sleep(10)
+                    await asyncio.sleep(10)
                     self.logger.info('Waited 10 seconds for connection')
+                    next_tick = time.monotonic()
                 except Exception as e:
-                    self.logger.warning("Exception: {}".format(e), exc_info=True)
-                    self.data = {}
-                    sleep(10)
-                    
+                    self.logger.warning("Exception: %s", e, exc_info=True)
+                    await asyncio.sleep(10)
+                    next_tick = time.monotonic()
+
+    def run(self) -> None:
+        try:
+            asyncio.run(self.run_async())
         except KeyboardInterrupt:
             self.logger.info("Finishing. Goodbye!")
+        finally:
+            self._write_api.close()